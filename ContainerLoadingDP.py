@@ -4,6 +4,14 @@ from anytree import AnyNode, RenderTree
 import sys
 import time
 import getopt
+import os
+import pickle
+import tempfile
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not reported
+    resource = None
 
 # Dynamic Programming, forward chain approach to the Container Loading Problem. Since all our costs are 1 or 2, we have
 # split this problem into cases of whether there exists a cost of 1 or not.
@@ -114,10 +122,76 @@ def validContainers(Z, Y, R):
 
     return validList
 
+# Frontier memory management. Only the leaves of the tree need their Z and Y to build the next stage, so internal nodes
+# drop theirs. When a memory budget is given, leaf states beyond the budget are appended to a temporary spill file and
+# read back when their stage is processed. Only Z is written, since Y can be rebuilt from R and the node's set.
+
+# Approximate in-memory size of a state
+# Input: Z DataFrame - set of containers in stacks, Y DataFrame - set of containers in railcars
+# Output: size int in bytes
+def stateSize(Z, Y):
+    size = Z.memory_usage(index=True, deep=True).sum() + Y.memory_usage(index=True, deep=True).sum()
+    return int(size)
+
+# Attach the state (Z, Y) to node, spilling Z to disk if the live frontier would exceed the memory budget.
+# Sizes are only measured when a budget is given, otherwise the state always stays in memory.
+# Input: node AnyNode, Z DataFrame, Y DataFrame, frontier dict - budget, live bytes and spill file
+def storeState(node, Z, Y, frontier):
+    node.stateBytes = 0
+    node.offset = None
+    if frontier['budget'] is not None:
+        node.stateBytes = stateSize(Z, Y)
+        if frontier['live'] + node.stateBytes > frontier['budget']:
+            spillFile = frontier['file']
+            spillFile.seek(0, os.SEEK_END)
+            node.offset = spillFile.tell()
+            pickle.dump(Z, spillFile, protocol=pickle.HIGHEST_PROTOCOL)
+            node.Z = None
+            node.Y = None
+            frontier['spilled'] += 1
+            return
+    node.Z = Z
+    node.Y = Y
+    frontier['live'] += node.stateBytes
+
+# Get the state of node, reading it back from the spill file if needed. A state read from disk is not re-attached to
+# the node, so it is released as soon as the caller is done with it.
+# Input: node AnyNode, frontier dict
+# Output: Z DataFrame, Y DataFrame
+def loadState(node, frontier):
+    if node.Z is not None:
+        return node.Z, node.Y
+    spillFile = frontier['file']
+    spillFile.seek(node.offset)
+    Z = pickle.load(spillFile)
+    R = frontier['R']
+    Y = R[R['contID'].isin(node.set)].reset_index(drop=True)
+    return Z, Y
 
-
-# Input: stackFile string, railcarFile string
-def main(stacksFile, railcarFile, debug):
+# Drop the state of a node that is no longer on the frontier
+# Input: node AnyNode, frontier dict
+def releaseState(node, frontier):
+    if node.Z is not None:
+        frontier['live'] -= node.stateBytes
+    node.Z = None
+    node.Y = None
+    node.offset = None
+
+# Peak resident set size of this process
+# Output: peak float in MB, or None if it cannot be measured on this platform
+def peakMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 1024.0 ** 2
+    return peak / 1024.0
+
+
+
+# Input: stackFile string, railcarFile string, memoryBudget float (optional) - frontier memory budget in MB
+def main(stacksFile, railcarFile, debug, memoryBudget=None):
     # Read in 'Stacks" and "Railcar" files
     stacks_df = stacksPreprocessing(stacksFile)
     railcar_df = railcarPreprocessing(railcarFile)
@@ -130,103 +204,114 @@ def main(stacksFile, railcarFile, debug):
     Y = railcar_df.drop(railcar_df.index[0:])
     Z = stacks_df
 
+    # Frontier bookkeeping, the spill file is only opened when a memory budget is given
+    frontier = {'budget': None, 'live': 0, 'file': None, 'spilled': 0, 'R': railcar_df}
+    if memoryBudget is not None:
+        frontier['budget'] = memoryBudget * 1024 ** 2
+        frontier['file'] = tempfile.TemporaryFile(prefix='ContainerLoadingDP_', suffix='.spill')
+
     # Begin two trees to store the different paths and costs
-    rootNode = AnyNode(id='root', cost=0, set=set(), Z=Z, Y=Y)
-
-    for k in range(N):
-        if debug:
-            print('\n\n --------------------------------- Stage k=' + str(k) + ' ---------------------------------')
-        leaves = rootNode.leaves
-        for leaf in leaves:
-            single=False
-            Z = leaf.Z
-            Y = leaf.Y
-
-            validChoices = validContainers(Z, Y, railcar_df)
-            validNodes = [0]*len(validChoices)
+    rootNode = AnyNode(id='root', cost=0, set=set())
+
+    # The spill file is closed even if a stage fails
+    try:
+        storeState(rootNode, Z, Y, frontier)
+        for k in range(N):
             if debug:
-                print(leaf.id)
-                print("Valid choice: " + str(validChoices))
-
-            # v is a containerID - string
-            for v, i in zip(validChoices, range(len(validChoices))):
-                node_set = set(leaf.set)
-                node_set.add(v)
-                validNodes[i] = AnyNode(id=v, parent=leaf, cost = depth(v, Z)+1, set=node_set)
-        # Since we only have two possible costs 1 and 2, we reduce the DP problem to Cases
-            # CASE 1: There exists at least 1 cost that is 1 - u_k becomes that container
-                # There is also only a single output node
-                # from v, take the containerID and move there.
-                # Move that containerID row from Z to Y.
-            if len(leaves) == 1:
-                for u_k in leaf.children:
+                print('\n\n --------------------------------- Stage k=' + str(k) + ' ---------------------------------')
+            leaves = rootNode.leaves
+            for leaf in leaves:
+                single=False
+                Z, Y = loadState(leaf, frontier)
+
+                validChoices = validContainers(Z, Y, railcar_df)
+                validNodes = [0]*len(validChoices)
+                if debug:
+                    print(leaf.id)
+                    print("Valid choice: " + str(validChoices))
+
+                # v is a containerID - string
+                for v, i in zip(validChoices, range(len(validChoices))):
+                    node_set = set(leaf.set)
+                    node_set.add(v)
+                    validNodes[i] = AnyNode(id=v, parent=leaf, cost = depth(v, Z)+1, set=node_set)
+            # Since we only have two possible costs 1 and 2, we reduce the DP problem to Cases
+                # CASE 1: There exists at least 1 cost that is 1 - u_k becomes that container
+                    # There is also only a single output node
+                    # from v, take the containerID and move there.
+                    # Move that containerID row from Z to Y.
+                if len(leaves) == 1:
+                    for u_k in leaf.children:
+                        if u_k.cost == 1:
+                            leaf.children = [u_k]
+                            Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
+                            storeState(u_k, Z_u, Y_u, frontier)
+                            single=True
+                            break
+                    if single:
+                        break
+                    else:
+                        # Case 2: All options have a cost of 2 with 1 output node
+                            # No containers have cost 1
+                        for u_k in leaf.children:
+                            Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
+                            storeState(u_k, Z_u, Y_u, frontier)
+            # Case 3: There is more than one output node
+            if len(leaves) > 1:
+                if debug:
+                    for pre, fill, node in RenderTree(rootNode):
+                        print("%s%s, %s, set=%s" % (pre, node.id, node.cost, node.set))
+                for u_k in rootNode.leaves:
                     if u_k.cost == 1:
-                        leaf.children = [u_k]
+                        Z, Y = loadState(u_k.parent, frontier)
+                        leaf = u_k.parent
+                        if debug:
+                            print(u_k.id)
+                            print(u_k.parent.id)
+                            print(Y['contID'])
                         Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
-                        u_k.Z = Z_u
-                        u_k.Y = Y_u
-                        single=True
-                        break
-                if single:
-                    break
-                else:
-                    # Case 2: All options have a cost of 2 with 1 output node
-                        # No containers have cost 1
+                        storeState(u_k, Z_u, Y_u, frontier)
+                        # Cut all branches except this one
+                        leaf.children = [u_k]
+                        fork = u_k
+                        child = u_k
+                        while True:
+                            if len(fork.children) > 1:
+                                fork.children = [child]
+                                single = True
+                                break
+                            else:
+                                child = fork
+                                fork = fork.parent
+                        if single:
+                            break
+
+                # Case 4: > 1 output nodes and no leaf has cost == 1
+                    # No containers have cost 1
+                if not single:
+                    Z, Y = loadState(leaf, frontier)
                     for u_k in leaf.children:
                         Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
-                        u_k.Z = Z_u
-                        u_k.Y = Y_u
-        # Case 3: There is more than one output node
-        if len(leaves) > 1:
+                        storeState(u_k, Z_u, Y_u, frontier)
+
+            # Leaves of this stage that were expanded or cut off are no longer on the frontier
+            for leaf in leaves:
+                if not leaf.is_leaf or leaf.root is not rootNode:
+                    releaseState(leaf, frontier)
+
             if debug:
+                print('Frontier: %d bytes in memory, %d states spilled to disk' % (frontier['live'], frontier['spilled']))
                 for pre, fill, node in RenderTree(rootNode):
                     print("%s%s, %s, set=%s" % (pre, node.id, node.cost, node.set))
-            for u_k in rootNode.leaves:
-                if u_k.cost == 1:
-                    Z = u_k.parent.Z
-                    Y = u_k.parent.Y
-                    leaf = u_k.parent
-                    if debug:
-                        print(u_k.id)
-                        print(u_k.parent.id)
-                        print(Y['contID'])
-                    Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
-                    u_k.Z = Z_u
-                    u_k.Y = Y_u
-                    # Cut all branches except this one
-                    leaf.children = [u_k]
-                    fork = u_k
-                    child = u_k
-                    while True:
-                        if len(fork.children) > 1:
-                            fork.children = [child]
-                            single = True
-                            break
-                        else:
-                            child = fork
-                            fork = fork.parent
-                    if single:
-                        break
-
-            # Case 4: > 1 output nodes and no leaf has cost == 1
-                # No containers have cost 1
-            if not single:
-                for u_k in leaf.children:
-                    Z = u_k.parent.Z
-                    Y = u_k.parent.Y
-                    Z_u, Y_u = move(u_k.id, Z, Y, railcar_df)
-                    u_k.Z = Z_u
-                    u_k.Y = Y_u
-
-        if debug:
-            for pre, fill, node in RenderTree(rootNode):
-                print("%s%s, %s, set=%s" % (pre, node.id, node.cost, node.set))
+    finally:
+        if frontier['file'] is not None:
+            frontier['file'].close()
 
     final_move = rootNode.leaves[0]
     for pre, fill, node in RenderTree(rootNode):
         print("%s%s, %s, set=%s" % (pre, node.id, node.cost, node.set))
 
-    if final_move.Y.shape[0] == N:
+    if len(final_move.set) == N:
         print('All containers have been placed\n')
         print('The containers in order are as follows.\n')
         costs = [np.inf]*(N+1)
@@ -240,13 +325,16 @@ def main(stacksFile, railcarFile, debug):
             k += 1
         sumC = sum(costs)
         print('Optimal cost: ' + str(sumC))
+        if memoryBudget is not None:
+            print('States spilled to disk: ' + str(frontier['spilled']))
 
 
     else:
         sys.exit('An error occured with the algorithm.')
 
 def usage():
-    print(" -h Help \n-s (string)_ <stack file path> \n-r (string) <railcar file path> \n -d (optional) Show every step output")
+    print(" -h Help \n-s (string)_ <stack file path> \n-r (string) <railcar file path> \n -d (optional) Show every step output"
+          " \n-m (optional, float) <memory budget in MB for the frontier, extra states are spilled to disk>")
 
 if __name__ == '__main__':
     # Start timer
@@ -254,8 +342,9 @@ if __name__ == '__main__':
     stacksFile=""
     railcarFile=""
     debug = False
+    memoryBudget = None
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hds:r:")
+        opts, args = getopt.getopt(sys.argv[1:], "hds:r:m:")
     except getopt.GetoptError as err:
         usage()
         sys.exit('The command line inputs were not given properly')
@@ -266,6 +355,15 @@ if __name__ == '__main__':
             railcarFile = arg
         elif opt == '-d':
             debug = True
+        elif opt == '-m':
+            try:
+                memoryBudget = float(arg)
+            except ValueError:
+                usage()
+                sys.exit('The memory budget must be a number of MB')
+            if memoryBudget < 0:
+                usage()
+                sys.exit('The memory budget must not be negative')
         else:
             usage()
             sys.exit(2)
@@ -273,7 +371,11 @@ if __name__ == '__main__':
         usage()
         sys.exit(2)
 
-    main(stacksFile, railcarFile, debug)
+    main(stacksFile, railcarFile, debug, memoryBudget)
     print("\n------------------------------------------------")
     print("Time taken to complete in seconds:")
-    print(time.time() - start)
\ No newline at end of file
+    print(time.time() - start)
+    peak = peakMemory()
+    if peak is not None:
+        print("Peak memory (RSS) in MB:")
+        print(peak)
\ No newline at end of file